@@ -1,11 +1,15 @@
 import sqlite3
 import threading
 import json
-from typing import Optional, Dict, Any
+import datetime
+from typing import Optional, Dict, Any, Iterator
 
 DB_PATH = "database.db"
 _lock = threading.Lock()
 
+# Actions that undo a punishment; they count towards moderator totals but not offender totals
+REVERSAL_ACTIONS = ("unban", "unmute")
+
 class Database:
     def __init__(self, path=DB_PATH):
         self.path = path
@@ -35,6 +39,68 @@ class Database:
                 timestamp INTEGER NOT NULL
             )
             """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_infractions_guild_user ON infractions (guild_id, user_id, timestamp)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_infractions_guild_id ON infractions (guild_id, id)"
+            )
+
+            # Rollup tables kept up to date by add_infraction so stats never scan infractions
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS infraction_daily (
+                guild_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                action TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, day, action)
+            )
+            """)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS infraction_mod_totals (
+                guild_id INTEGER NOT NULL,
+                mod_id INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, mod_id, action)
+            )
+            """)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS infraction_user_totals (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, user_id)
+            )
+            """)
+
+            # Backfill rollups for databases created before they existed
+            has_rollups = self._conn.execute("SELECT 1 FROM infraction_mod_totals LIMIT 1").fetchone()
+            has_infractions = self._conn.execute("SELECT 1 FROM infractions LIMIT 1").fetchone()
+            if has_infractions and not has_rollups:
+                self._rebuild_rollups()
+
+    def _rebuild_rollups(self):
+        # Caller must hold _lock inside a transaction
+        self._conn.execute("DELETE FROM infraction_daily")
+        self._conn.execute("DELETE FROM infraction_mod_totals")
+        self._conn.execute("DELETE FROM infraction_user_totals")
+        self._conn.execute("""
+        INSERT INTO infraction_daily (guild_id, day, action, count)
+        SELECT guild_id, date(timestamp, 'unixepoch'), action, COUNT(*)
+        FROM infractions GROUP BY guild_id, date(timestamp, 'unixepoch'), action
+        """)
+        self._conn.execute("""
+        INSERT INTO infraction_mod_totals (guild_id, mod_id, action, count)
+        SELECT guild_id, mod_id, action, COUNT(*)
+        FROM infractions GROUP BY guild_id, mod_id, action
+        """)
+        self._conn.execute("""
+        INSERT INTO infraction_user_totals (guild_id, user_id, count)
+        SELECT guild_id, user_id, COUNT(*)
+        FROM infractions WHERE action NOT IN ({})
+        GROUP BY guild_id, user_id
+        """.format(", ".join("?" for _ in REVERSAL_ACTIONS)), REVERSAL_ACTIONS)
 
     def get_guild_config(self, guild_id: int) -> Optional[Dict[str, Any]]:
         with _lock, self._conn:
@@ -61,6 +127,24 @@ class Database:
             INSERT INTO infractions (guild_id, user_id, mod_id, action, reason, timestamp)
             VALUES (?, ?, ?, ?, ?, ?)
             """, (guild_id, user_id, mod_id, action, reason, timestamp))
+            day = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%d")
+            self._conn.execute("""
+            INSERT INTO infraction_daily (guild_id, day, action, count)
+            VALUES (?, ?, ?, 1)
+            ON CONFLICT(guild_id, day, action) DO UPDATE SET count = count + 1
+            """, (guild_id, day, action))
+            self._conn.execute("""
+            INSERT INTO infraction_mod_totals (guild_id, mod_id, action, count)
+            VALUES (?, ?, ?, 1)
+            ON CONFLICT(guild_id, mod_id, action) DO UPDATE SET count = count + 1
+            """, (guild_id, mod_id, action))
+            if action in REVERSAL_ACTIONS:
+                return
+            self._conn.execute("""
+            INSERT INTO infraction_user_totals (guild_id, user_id, count)
+            VALUES (?, ?, 1)
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET count = count + 1
+            """, (guild_id, user_id))
 
     def get_infractions(self, guild_id: int, user_id: int):
         with _lock, self._conn:
@@ -69,6 +153,54 @@ class Database:
             """, (guild_id, user_id)).fetchall()
             return [dict(row) for row in rows]
 
+    def iter_infractions(self, guild_id: int, since: Optional[int] = None, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        # Keyset pagination: memory stays bounded by batch_size and the lock is
+        # released between batches so inserts are not blocked during an export.
+        last_id = 0
+        since = since or 0
+        while True:
+            with _lock:
+                rows = self._conn.execute("""
+                SELECT * FROM infractions
+                WHERE guild_id = ? AND id > ? AND timestamp >= ?
+                ORDER BY id LIMIT ?
+                """, (guild_id, last_id, since, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_id = rows[-1]["id"]
+
+    def get_infraction_stats(self, guild_id: int, days: int = 30, limit: int = 10) -> Dict[str, Any]:
+        start_day = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        with _lock:
+            per_day = self._conn.execute("""
+            SELECT day, SUM(count) AS count FROM infraction_daily
+            WHERE guild_id = ? AND day >= ?
+            GROUP BY day ORDER BY day
+            """, (guild_id, start_day)).fetchall()
+            per_action = self._conn.execute("""
+            SELECT action, SUM(count) AS count FROM infraction_daily
+            WHERE guild_id = ? AND day >= ?
+            GROUP BY action ORDER BY count DESC
+            """, (guild_id, start_day)).fetchall()
+            per_mod = self._conn.execute("""
+            SELECT mod_id, SUM(count) AS count FROM infraction_mod_totals
+            WHERE guild_id = ?
+            GROUP BY mod_id ORDER BY count DESC LIMIT ?
+            """, (guild_id, limit)).fetchall()
+            top_offenders = self._conn.execute("""
+            SELECT user_id, count FROM infraction_user_totals
+            WHERE guild_id = ?
+            ORDER BY count DESC LIMIT ?
+            """, (guild_id, limit)).fetchall()
+        return {
+            "per_day": [dict(row) for row in per_day],
+            "per_action": [dict(row) for row in per_action],
+            "per_mod": [dict(row) for row in per_mod],
+            "top_offenders": [dict(row) for row in top_offenders],
+        }
+
     def close(self):
         with _lock:
             self._conn.close()
@@ -8,8 +8,16 @@ import asyncio
 import datetime
 import json
 import re
+import csv
+import io
+import tempfile
+import time
+import functools
+import regex
 import pytz
 from typing import Optional
+from re import _parser as sre_parse, _constants as sre_constants
+import database
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -104,6 +112,15 @@ class Database:
             self._conn.commit()
 
 db = Database()
+infraction_db = database.Database()
+
+async def record_infraction(guild: discord.Guild, user_id: int, mod_id: int, action: str, reason: Optional[str]):
+    timestamp = int(discord.utils.utcnow().timestamp())
+    try:
+        await asyncio.to_thread(infraction_db.add_infraction, guild.id, user_id, mod_id, action, reason, timestamp)
+    except Exception as e:
+        # The moderation action already happened; don't fail the command, but don't lose the row silently either
+        print(f"Failed to record {action} infraction for user {user_id} in guild {guild.id}: {e}")
 
 async def send_log(guild: discord.Guild, log_type: str, embed: discord.Embed):
     channel_id = await db.get_log_channel(guild.id, log_type)
@@ -134,6 +151,7 @@ async def kick(interaction: discord.Interaction, member: discord.Member, reason:
         embed.add_field(name="Moderator", value=str(interaction.user), inline=True)
         embed.add_field(name="Reason", value=reason, inline=False)
         await send_log(interaction.guild, "kicks", embed)
+        await record_infraction(interaction.guild, member.id, interaction.user.id, "kick", reason)
     except Exception as e:
         await interaction.response.send_message(f"Failed to kick member: {e}", ephemeral=True)
 
@@ -154,6 +172,7 @@ async def ban(interaction: discord.Interaction, member: discord.Member, reason:
         embed.add_field(name="Moderator", value=str(interaction.user), inline=True)
         embed.add_field(name="Reason", value=reason, inline=False)
         await send_log(interaction.guild, "bans", embed)
+        await record_infraction(interaction.guild, member.id, interaction.user.id, "ban", reason)
     except Exception as e:
         await interaction.response.send_message(f"Failed to ban member: {e}", ephemeral=True)
 
@@ -171,6 +190,7 @@ async def unban(interaction: discord.Interaction, user_id: int):
         embed.add_field(name="Member", value=str(user), inline=True)
         embed.add_field(name="Moderator", value=str(interaction.user), inline=True)
         await send_log(interaction.guild, "bans", embed)
+        await record_infraction(interaction.guild, user.id, interaction.user.id, "unban", None)
     except Exception as e:
         await interaction.response.send_message(f"Failed to unban: {e}", ephemeral=True)
 
@@ -209,6 +229,7 @@ async def mute(interaction: discord.Interaction, member: discord.Member, reason:
         embed.add_field(name="Moderator", value=str(interaction.user), inline=True)
         embed.add_field(name="Reason", value=reason, inline=False)
         await send_log(guild, "mutes", embed)
+        await record_infraction(guild, member.id, interaction.user.id, "mute", reason)
     except Exception as e:
         await interaction.response.send_message(f"Failed to mute member: {e}", ephemeral=True)
 
@@ -232,6 +253,7 @@ async def unmute(interaction: discord.Interaction, member: discord.Member):
         embed.add_field(name="Member", value=str(member), inline=True)
         embed.add_field(name="Moderator", value=str(interaction.user), inline=True)
         await send_log(guild, "mutes", embed)
+        await record_infraction(guild, member.id, interaction.user.id, "unmute", None)
     except Exception as e:
         await interaction.response.send_message(f"Failed to unmute member: {e}", ephemeral=True)
 
@@ -495,6 +517,254 @@ async def automod(interaction: discord.Interaction, feature: str, enabled: bool)
     await db.set_guild_config(interaction.guild.id, config)
     await interaction.response.send_message(f"Automod feature `{feature}` set to {enabled}")
 
+# Custom automod rules
+
+AUTOMOD_MAX_RULES = 25
+AUTOMOD_MAX_NAME_LENGTH = 32
+AUTOMOD_DISPLAY_PATTERN_LENGTH = 100
+AUTOMOD_MAX_PATTERN_LENGTH = 200
+AUTOMOD_TIME_BUDGET = 0.05  # seconds of regex matching allowed per message
+AUTOMOD_MAX_TIMEOUTS = 3  # rules that time out this many messages in a row are skipped until re-added
+AUTOMOD_REGEX_FLAGS = regex.IGNORECASE | regex.VERSION0
+# Valid stdlib quantifier braces; any other unescaped "{" is a literal to re but may mean something else to regex
+AUTOMOD_QUANTIFIER = re.compile(r"\{(?:\d+(?:,\d*)?|,\d+)\}")
+
+# (guild_id, rule name) -> hit counters and timing, reset when a rule is added or removed
+automod_rule_stats = {}
+
+def _first_chars(items) -> Optional[set]:
+    # Characters a sequence can start with, or None when that isn't a small known set
+    # (wildcards, classes, or a sequence that can match the empty string)
+    if not items:
+        return None
+    op, av = items[0]
+    if op == sre_constants.LITERAL:
+        return {chr(av).lower()}
+    if op == sre_constants.SUBPATTERN:
+        return _first_chars(av[-1])
+    if op == sre_constants.ATOMIC_GROUP:
+        return _first_chars(av)
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT) and av[0] >= 1:
+        return _first_chars(av[2])
+    if op == sre_constants.BRANCH:
+        chars = set()
+        for branch in av[1]:
+            first = _first_chars(branch)
+            if first is None:
+                return None
+            chars |= first
+        return chars
+    if op == sre_constants.IN:
+        chars = set()
+        for set_op, set_av in av:
+            if set_op == sre_constants.LITERAL:
+                chars.add(chr(set_av).lower())
+            elif set_op == sre_constants.RANGE and set_av[1] - set_av[0] < 256:
+                chars.update(chr(c).lower() for c in range(set_av[0], set_av[1] + 1))
+            else:
+                return None
+        return chars
+    return None
+
+def _branches_overlap(branches) -> bool:
+    seen = set()
+    for branch in branches:
+        first = _first_chars(branch)
+        if first is None or seen & first:
+            return True
+        seen |= first
+    return False
+
+def _pattern_risk(items, outer=None) -> Optional[str]:
+    # outer is None outside any repeat, "bounded" inside {n,m} with m > 1, "unbounded" inside * / + / {n,}
+    for op, av in items:
+        if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT):
+            low, high, sub = av
+            unbounded = high == sre_constants.MAXREPEAT
+            if (outer == "unbounded" and high != low) or (outer == "bounded" and unbounded):
+                return "nested quantifiers can cause catastrophic backtracking"
+            if unbounded or outer == "unbounded":
+                inner = "unbounded"
+            elif high > 1 or outer == "bounded":
+                inner = "bounded"
+            else:
+                inner = None
+            reason = _pattern_risk(sub, inner)
+        elif op == sre_constants.SUBPATTERN:
+            reason = _pattern_risk(av[-1], outer)
+        elif op == sre_constants.ATOMIC_GROUP:
+            reason = _pattern_risk(av, outer)
+        elif op == sre_constants.BRANCH:
+            if outer and _branches_overlap(av[1]):
+                reason = "repeated alternatives that can match the same text can cause catastrophic backtracking"
+            else:
+                reason = next((r for r in (_pattern_risk(b, outer) for b in av[1]) if r), None)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            reason = _pattern_risk(av[1], outer)
+        elif op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            reason = "backreferences are not allowed"
+        else:
+            reason = None
+        if reason:
+            return reason
+    return None
+
+def _has_unescaped_brace(pattern: str) -> bool:
+    # regex reads some brace forms the stdlib treats as literal text, e.g. fuzzy constraints like {e<=2},
+    # so require every brace outside a character class to be escaped or be a plain quantifier
+    i, in_class = 0, False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+            i += 1
+            if pattern[i:i + 1] == "^":
+                i += 1
+            if pattern[i:i + 1] == "]":
+                i += 1
+            continue
+        elif c == "{":
+            quantifier = AUTOMOD_QUANTIFIER.match(pattern, i)
+            if not quantifier:
+                return True
+            i = quantifier.end()
+            continue
+        i += 1
+    return False
+
+def validate_automod_pattern(pattern: str) -> Optional[str]:
+    if len(pattern) > AUTOMOD_MAX_PATTERN_LENGTH:
+        return f"Pattern must be at most {AUTOMOD_MAX_PATTERN_LENGTH} characters."
+    # Rules run on the regex module (in its re-compatible VERSION0 mode), but are parsed with the stdlib's
+    # private parser on purpose: only syntax both modules read the same way is accepted, so the risk
+    # check sees the pattern that will actually run. Unknown escapes and inline flags fail to parse here;
+    # braces are the one construct re accepts as literal text that regex may not, so they're checked separately.
+    if _has_unescaped_brace(pattern):
+        return "Invalid pattern: literal `{` must be escaped as `\\{`."
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception as e:
+        return f"Invalid pattern (only standard Python `re` syntax is supported): {e}"
+    reason = _pattern_risk(parsed)
+    if reason:
+        return f"Pattern rejected: {reason}."
+    # Compiled outside the shared cache so rejected patterns never take up slots
+    try:
+        compiled = regex.compile(pattern, AUTOMOD_REGEX_FLAGS)
+    except Exception as e:
+        return f"Invalid pattern: {e}"
+    if compiled.search("") is not None:
+        return "Pattern rejected: it matches empty text, so it would remove every message."
+    return None
+
+@functools.lru_cache(maxsize=512)
+def compile_automod_pattern(pattern: str):
+    # Keyed on the pattern alone so guilds using the same rule share one compiled object
+    return regex.compile(pattern, AUTOMOD_REGEX_FLAGS)
+
+def match_automod_rules(rules: list, content: str):
+    # Runs in a worker thread; regex releases the GIL and enforces the time budget itself.
+    # Each rule gets an equal slice of the budget and is only charged a timeout if it had its full slice.
+    deadline = time.perf_counter() + AUTOMOD_TIME_BUDGET
+    rule_slice = AUTOMOD_TIME_BUDGET / len(rules)
+    results = []
+    for name, pattern in rules:
+        timeout = min(deadline - time.perf_counter(), rule_slice)
+        if timeout <= 0:
+            break
+        start = time.perf_counter()
+        try:
+            matched = compile_automod_pattern(pattern).search(content, timeout=timeout, concurrent=True) is not None
+            timed_out = False
+        except TimeoutError:
+            if timeout < rule_slice:
+                # Budget exhausted by earlier rules; not this rule's fault
+                break
+            matched, timed_out = False, True
+        results.append((name, matched, timed_out, time.perf_counter() - start))
+        if matched:
+            break
+    return results
+
+@tree.command(name="automod_rule_add", description="Add or replace a custom automod regex rule")
+@app_commands.describe(name="Rule name", pattern="Regular expression to match (case-insensitive)")
+async def automod_rule_add(interaction: discord.Interaction, name: str, pattern: str):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("Admin permission required.", ephemeral=True)
+        return
+    name = name.lower()
+    if len(name) > AUTOMOD_MAX_NAME_LENGTH:
+        await interaction.response.send_message(f"Rule name must be at most {AUTOMOD_MAX_NAME_LENGTH} characters.", ephemeral=True)
+        return
+    error = validate_automod_pattern(pattern)
+    if error:
+        await interaction.response.send_message(error, ephemeral=True)
+        return
+    config = await db.get_guild_config(interaction.guild.id)
+    rules = config.get("automod_rules", {})
+    if name not in rules and len(rules) >= AUTOMOD_MAX_RULES:
+        await interaction.response.send_message(f"A server can have at most {AUTOMOD_MAX_RULES} rules.", ephemeral=True)
+        return
+    rules[name] = pattern
+    config["automod_rules"] = rules
+    await db.set_guild_config(interaction.guild.id, config)
+    automod_rule_stats.pop((interaction.guild.id, name), None)
+    await interaction.response.send_message(f"Automod rule `{name}` set.")
+
+@tree.command(name="automod_rule_remove", description="Remove a custom automod regex rule")
+@app_commands.describe(name="Rule name")
+async def automod_rule_remove(interaction: discord.Interaction, name: str):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("Admin permission required.", ephemeral=True)
+        return
+    name = name.lower()
+    config = await db.get_guild_config(interaction.guild.id)
+    rules = config.get("automod_rules", {})
+    if name not in rules:
+        await interaction.response.send_message(f"No automod rule named `{name}`.", ephemeral=True)
+        return
+    del rules[name]
+    config["automod_rules"] = rules
+    await db.set_guild_config(interaction.guild.id, config)
+    automod_rule_stats.pop((interaction.guild.id, name), None)
+    await interaction.response.send_message(f"Automod rule `{name}` removed.")
+
+@tree.command(name="automod_rules", description="List custom automod rules with hit counts and timing")
+async def automod_rules(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("Admin permission required.", ephemeral=True)
+        return
+    config = await db.get_guild_config(interaction.guild.id)
+    rules = config.get("automod_rules", {})
+    if not rules:
+        await interaction.response.send_message("No custom automod rules set.", ephemeral=True)
+        return
+    # 25 rules don't fit in one embed's 6000-character limit, so spread them over several messages
+    embeds = [discord.Embed(title="Automod Rules", color=discord.Color.blurple(), timestamp=datetime.datetime.utcnow())]
+    for name, pattern in rules.items():
+        stats = automod_rule_stats.get((interaction.guild.id, name), {})
+        checks = stats.get("checks", 0)
+        avg_ms = stats.get("total_time", 0.0) / checks * 1000 if checks else 0.0
+        status = " (disabled: too many timeouts)" if stats.get("consecutive_timeouts", 0) >= AUTOMOD_MAX_TIMEOUTS else ""
+        shown = pattern if len(pattern) <= AUTOMOD_DISPLAY_PATTERN_LENGTH else pattern[:AUTOMOD_DISPLAY_PATTERN_LENGTH] + "…"
+        field_name = f"{name}{status}"
+        field_value = (f"{discord.utils.escape_markdown(shown)}\nHits: {stats.get('hits', 0)} / {checks} checks\n"
+                       f"Avg: {avg_ms:.2f} ms, Max: {stats.get('max_time', 0.0) * 1000:.2f} ms, Timeouts: {stats.get('timeouts', 0)}")
+        embed = embeds[-1]
+        if len(embed.fields) >= 25 or len(embed) + len(field_name) + len(field_value) > 5500:
+            embed = discord.Embed(title="Automod Rules (cont.)", color=discord.Color.blurple())
+            embeds.append(embed)
+        embed.add_field(name=field_name, value=field_value, inline=False)
+    await interaction.response.send_message(embed=embeds[0], ephemeral=True)
+    for embed in embeds[1:]:
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
 async def check_automod(message):
     config = await db.get_guild_config(message.guild.id)
     automod = config.get("automod", {})
@@ -524,6 +794,35 @@ async def check_automod(message):
             except Exception:
                 pass
 
+    rules = [
+        (name, pattern) for name, pattern in config.get("automod_rules", {}).items()
+        if automod_rule_stats.get((message.guild.id, name), {}).get("consecutive_timeouts", 0) < AUTOMOD_MAX_TIMEOUTS
+    ]
+    if rules:
+        results = await asyncio.to_thread(match_automod_rules, rules, message.content)
+        for name, matched, timed_out, elapsed in results:
+            stats = automod_rule_stats.setdefault((message.guild.id, name), {"hits": 0, "checks": 0, "timeouts": 0, "consecutive_timeouts": 0, "total_time": 0.0, "max_time": 0.0})
+            stats["checks"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            if not timed_out:
+                stats["consecutive_timeouts"] = 0
+            else:
+                stats["timeouts"] += 1
+                stats["consecutive_timeouts"] += 1
+                if stats["consecutive_timeouts"] == AUTOMOD_MAX_TIMEOUTS:
+                    embed = discord.Embed(title="Automod Rule Disabled", color=discord.Color.orange(), timestamp=datetime.datetime.utcnow())
+                    embed.add_field(name="Rule", value=name, inline=True)
+                    embed.add_field(name="Reason", value=f"Timed out on {AUTOMOD_MAX_TIMEOUTS} messages in a row. Re-add the rule to enable it again.", inline=False)
+                    await send_log(message.guild, "modactions", embed)
+            if matched:
+                stats["hits"] += 1
+                try:
+                    await message.delete()
+                    await message.channel.send(f"{message.author.mention}, your message was removed by automod rule `{name}`.", delete_after=5)
+                except Exception:
+                    pass
+
 @bot.event
 async def on_message_edit(before, after):
     if after.author.bot or not after.guild:
@@ -585,6 +884,107 @@ async def unlock(interaction: discord.Interaction, channel: Optional[discord.Tex
     except Exception as e:
         await interaction.response.send_message(f"Failed to unlock: {e}", ephemeral=True)
 
+# main.py — Part 6: Infraction analytics and export
+
+@tree.command(name="modstats", description="Show moderation statistics for this server")
+@app_commands.describe(days="Number of days to include in the daily breakdown (1-90)")
+async def modstats(interaction: discord.Interaction, days: int = 30):
+    if not interaction.user.guild_permissions.view_audit_log:
+        await interaction.response.send_message("You need View Audit Log permission.", ephemeral=True)
+        return
+    if days < 1 or days > 90:
+        await interaction.response.send_message("Days must be between 1 and 90.", ephemeral=True)
+        return
+    stats = await asyncio.to_thread(infraction_db.get_infraction_stats, interaction.guild.id, days)
+    embed = discord.Embed(title="Moderation Statistics", color=discord.Color.blurple(), timestamp=datetime.datetime.utcnow())
+    per_action = "\n".join(f"{row['action']}: {row['count']}" for row in stats["per_action"])
+    embed.add_field(name=f"Actions (last {days} days)", value=per_action or "None", inline=True)
+    # A 90-day window doesn't fit in one 1024-character field, so split it across several
+    per_day_chunks = [""]
+    for row in stats["per_day"]:
+        line = f"{row['day']}: {row['count']}\n"
+        if len(per_day_chunks[-1]) + len(line) > 1024:
+            per_day_chunks.append("")
+        per_day_chunks[-1] += line
+    for i, chunk in enumerate(per_day_chunks):
+        embed.add_field(name="Actions per day" if i == 0 else "Actions per day (cont.)", value=chunk or "None", inline=True)
+    per_mod = "\n".join(f"<@{row['mod_id']}>: {row['count']}" for row in stats["per_mod"])
+    embed.add_field(name="Actions per moderator (all time)", value=per_mod or "None", inline=False)
+    offenders = "\n".join(f"<@{row['user_id']}>: {row['count']}" for row in stats["top_offenders"])
+    embed.add_field(name="Top offenders (all time)", value=offenders or "None", inline=False)
+    await interaction.response.send_message(embed=embed)
+
+EXPORT_FIELDS = ["id", "guild_id", "user_id", "mod_id", "action", "reason", "timestamp"]
+EXPORT_SIZE_CHECK_INTERVAL = 500  # rows written between checks against the upload limit
+
+def write_infraction_export(guild_id: int, fmt: str, since: Optional[int], size_limit: int):
+    # Streams rows straight to a temp file so memory use doesn't grow with the export size.
+    # Returns None as soon as the file grows past size_limit instead of finishing a file that can't be uploaded.
+    fp = tempfile.TemporaryFile()
+    try:
+        text = io.TextIOWrapper(fp, encoding="utf-8", newline="")
+
+        def too_large():
+            text.flush()
+            return fp.tell() > size_limit
+
+        rows = infraction_db.iter_infractions(guild_id, since=since)
+        if fmt == "csv":
+            writer = csv.DictWriter(text, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            for i, row in enumerate(rows, 1):
+                writer.writerow(row)
+                if i % EXPORT_SIZE_CHECK_INTERVAL == 0 and too_large():
+                    fp.close()
+                    return None
+        else:
+            text.write("[")
+            for i, row in enumerate(rows, 1):
+                if i > 1:
+                    text.write(",")
+                text.write(json.dumps(row))
+                if i % EXPORT_SIZE_CHECK_INTERVAL == 0 and too_large():
+                    fp.close()
+                    return None
+            text.write("]")
+        if too_large():
+            fp.close()
+            return None
+        text.detach()
+        fp.seek(0)
+        return fp
+    except Exception:
+        fp.close()
+        raise
+
+@tree.command(name="modexport", description="Export infractions as a CSV or JSON file")
+@app_commands.describe(format="File format (csv or json)", days="Only include the last N days (optional)")
+async def modexport(interaction: discord.Interaction, format: str = "csv", days: Optional[int] = None):
+    if not interaction.user.guild_permissions.view_audit_log:
+        await interaction.response.send_message("You need View Audit Log permission.", ephemeral=True)
+        return
+    fmt = format.lower()
+    if fmt not in {"csv", "json"}:
+        await interaction.response.send_message("Invalid format. Valid: csv, json", ephemeral=True)
+        return
+    if days is not None and (days < 1 or days > 3650):
+        await interaction.response.send_message("Days must be between 1 and 3650.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    try:
+        since = None
+        if days is not None:
+            since = int((discord.utils.utcnow() - datetime.timedelta(days=days)).timestamp())
+        fp = await asyncio.to_thread(write_infraction_export, interaction.guild.id, fmt, since, interaction.guild.filesize_limit)
+        if fp is None:
+            await interaction.followup.send("Export is too large to upload. Try a smaller `days` range.", ephemeral=True)
+            return
+        with fp:
+            filename = f"infractions-{interaction.guild.id}.{fmt}"
+            await interaction.followup.send(file=discord.File(fp, filename=filename), ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send(f"Failed to export: {e}", ephemeral=True)
+
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")